@@ -14,7 +14,12 @@
 # ==============================================================================
 """Locomotion environments."""
 
+import copy
+import dataclasses
 import functools
+import hashlib
+import importlib.util
+import json
 from typing import Any, Callable, Dict, Optional, Tuple, Type, Union
 
 import jax
@@ -25,29 +30,40 @@ from methods.envs import mjx_env
 from methods.envs.locomotion.g1 import joystick as g1_joystick
 from methods.envs.locomotion.g1 import randomize as g1_randomize
 
-_envs = {
-    "G1JoystickFlatTerrain": functools.partial(
-        g1_joystick.Joystick, task="flat_terrain"
+DomainRandomizer = Callable[[mjx.Model, jax.Array], Tuple[mjx.Model, mjx.Model]]
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class EnvSpec:
+  """Registry entry for a locomotion environment."""
+
+  ctor: Callable[..., mjx_env.MjxEnv]
+  default_cfg: Callable[[], config_dict.ConfigDict]
+  randomizer: Optional[DomainRandomizer] = None
+
+
+_REGISTRY: Dict[str, EnvSpec] = {
+    "G1JoystickFlatTerrain": EnvSpec(
+        functools.partial(g1_joystick.Joystick, task="flat_terrain"),
+        g1_joystick.default_config,
+        g1_randomize.domain_randomize,
     ),
-    "G1JoystickRoughTerrain": functools.partial(
-        g1_joystick.Joystick, task="rough_terrain"
+    "G1JoystickRoughTerrain": EnvSpec(
+        functools.partial(g1_joystick.Joystick, task="rough_terrain"),
+        g1_joystick.default_config,
+        g1_randomize.domain_randomize,
     ),
 }
 
-_cfgs = {
-    "G1JoystickFlatTerrain": g1_joystick.default_config,
-    "G1JoystickRoughTerrain": g1_joystick.default_config,
-}
-
-_randomizer = {
-    "G1JoystickFlatTerrain": g1_randomize.domain_randomize,
-    "G1JoystickRoughTerrain": g1_randomize.domain_randomize,
-}
+# Constructed environments keyed by a hash of (env_name, config, overrides).
+# Environments are immutable after construction, so instances returned from
+# `load` are shallow copies that share the compiled MjModel / mjx.Model.
+_ENV_CACHE: Dict[str, mjx_env.MjxEnv] = {}
 
 
 def __getattr__(name):
   if name == "ALL_ENVS":
-    return tuple(_envs.keys())
+    return tuple(_REGISTRY.keys())
   raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 
@@ -55,6 +71,7 @@ def register_environment(
     env_name: str,
     env_class: Type[mjx_env.MjxEnv],
     cfg_class: Callable[[], config_dict.ConfigDict],
+    randomizer: Optional[DomainRandomizer] = None,
 ) -> None:
   """Register a new environment.
 
@@ -62,19 +79,34 @@ def register_environment(
       env_name: The name of the environment.
       env_class: The environment class.
       cfg_class: The default configuration.
+      randomizer: The default domain randomizer, if any.
   """
-  _envs[env_name] = env_class
-  _cfgs[env_name] = cfg_class
+  _REGISTRY[env_name] = EnvSpec(env_class, cfg_class, randomizer)
+  _ENV_CACHE.clear()
 
 
 def get_default_config(env_name: str) -> config_dict.ConfigDict:
   """Get the default configuration for an environment."""
-  if env_name not in _cfgs:
+  spec = _REGISTRY.get(env_name)
+  if spec is None:
     raise ValueError(
         f"Env '{env_name}' not found in default configs. Available configs:"
-        f" {list(_cfgs.keys())}"
+        f" {list(_REGISTRY.keys())}"
     )
-  return _cfgs[env_name]()
+  return spec.default_cfg()
+
+
+def _cache_key(
+    env_name: str,
+    config: config_dict.ConfigDict,
+    config_overrides: Optional[Dict[str, Union[str, int, list[Any]]]],
+) -> str:
+  payload = json.dumps(
+      [env_name, config.to_dict(), config_overrides or {}],
+      sort_keys=True,
+      default=str,
+  )
+  return hashlib.blake2b(payload.encode("utf-8")).hexdigest()
 
 
 def load(
@@ -91,25 +123,45 @@ def load(
       config_overrides: A dictionary of overrides for the configuration.
 
   Returns:
-      An instance of the environment.
+      An instance of the environment. Repeated calls with the same
+      configuration share the underlying compiled model and a private copy
+      of the configuration.
   """
   mjx_env.ensure_menagerie_exists()  # Ensure menagerie exists when environment is loaded.
-  if env_name not in _envs:
+  spec = _REGISTRY.get(env_name)
+  if spec is None:
     raise ValueError(
-        f"Env '{env_name}' not found. Available envs: {_cfgs.keys()}"
+        f"Env '{env_name}' not found. Available envs: {_REGISTRY.keys()}"
     )
-  config = config or get_default_config(env_name)
-  return _envs[env_name](config=config, config_overrides=config_overrides)
-
-
-def get_domain_randomizer(
-    env_name: str,
-) -> Optional[Callable[[mjx.Model, jax.Array], Tuple[mjx.Model, mjx.Model]]]:
+  config = config or spec.default_cfg()
+  # mjx.put_model and mjx.step dispatch to MuJoCo Warp for impl="warp".
+  if (
+      config.get("impl") == "warp"
+      and importlib.util.find_spec("mujoco_warp") is None
+  ):
+    raise ImportError(
+        "impl='warp' requires the mujoco_warp package. Install it with"
+        " `pip install mujoco_warp` or use impl='jax'."
+    )
+  key = _cache_key(env_name, config, config_overrides)
+  if key not in _ENV_CACHE:
+    env = spec.ctor(config=config, config_overrides=config_overrides)
+    # Detach the cached env from the caller's config, which stays writable.
+    env._config = copy.deepcopy(env._config)  # pylint: disable=protected-access
+    _ENV_CACHE[key] = env
+    # Constructors may update `config` in place (e.g. contact limits for rough
+    # terrain), so also cache under the resulting config.
+    _ENV_CACHE.setdefault(_cache_key(env_name, config, config_overrides), env)
+  return copy.copy(_ENV_CACHE[key])
+
+
+def get_domain_randomizer(env_name: str) -> Optional[DomainRandomizer]:
   """Get the default domain randomizer for an environment."""
-  if env_name not in _randomizer:
+  spec = _REGISTRY.get(env_name)
+  if spec is None or spec.randomizer is None:
     print(
         f"Env '{env_name}' does not have a domain randomizer in the locomotion"
         " registry."
     )
     return None
-  return _randomizer[env_name]
+  return spec.randomizer
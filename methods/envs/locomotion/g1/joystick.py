@@ -291,6 +291,8 @@ class Joystick(g1_base.G1Env):
         njmax=self._config.njmax,
     )
     data = mjx.forward(self.mjx_model, data)
+    # Strongly type `time` so jitted steps are not recompiled after reset.
+    data = data.replace(time=jp.asarray(data.time, dtype=jp.float32))
 
     # Phase, freq=U(1.0, 1.5)
     rng, key = jax.random.split(rng)
@@ -20,65 +20,87 @@ FLOOR_GEOM_ID = 0
 TORSO_BODY_ID = 16
 
 
-def domain_randomize(model: mjx.Model, rng: jax.Array):
+@jax.jit
+def _rand_dynamics(
+    pair_friction: jax.Array,
+    dof_frictionloss: jax.Array,
+    dof_armature: jax.Array,
+    body_mass: jax.Array,
+    qpos0: jax.Array,
+    rng: jax.Array,
+):
+  """Samples per-world model fields. Compiled once per number of worlds."""
+
   @jax.vmap
-  def rand_dynamics(rng):
+  def sample(rng):
     # Floor / foot friction: =U(0.4, 1.0).
     rng, key = jax.random.split(rng)
     friction = jax.random.uniform(key, minval=0.4, maxval=1.0)
-    pair_friction = model.pair_friction.at[0:2, 0:2].set(friction)
+    new_pair_friction = pair_friction.at[0:2, 0:2].set(friction)
 
     # Scale static friction: *U(0.9, 1.1).
     rng, key = jax.random.split(rng)
-    frictionloss = model.dof_frictionloss[6:] * jax.random.uniform(
+    frictionloss = dof_frictionloss[6:] * jax.random.uniform(
         key, shape=(29,), minval=0.5, maxval=2.0
     )
-    dof_frictionloss = model.dof_frictionloss.at[6:].set(frictionloss)
+    new_dof_frictionloss = dof_frictionloss.at[6:].set(frictionloss)
 
     # Scale armature: *U(1.0, 1.05).
     rng, key = jax.random.split(rng)
-    armature = model.dof_armature[6:] * jax.random.uniform(
+    armature = dof_armature[6:] * jax.random.uniform(
         key, shape=(29,), minval=1.0, maxval=1.05
     )
-    dof_armature = model.dof_armature.at[6:].set(armature)
+    new_dof_armature = dof_armature.at[6:].set(armature)
 
     # Scale all link masses: *U(0.9, 1.1).
     rng, key = jax.random.split(rng)
     dmass = jax.random.uniform(
-        key, shape=(model.nbody,), minval=0.9, maxval=1.1
+        key, shape=body_mass.shape, minval=0.9, maxval=1.1
     )
-    body_mass = model.body_mass.at[:].set(model.body_mass * dmass)
+    new_body_mass = body_mass.at[:].set(body_mass * dmass)
 
     # Add mass to torso: +U(-1.0, 1.0).
     rng, key = jax.random.split(rng)
     dmass = jax.random.uniform(key, minval=-1.0, maxval=1.0)
-    body_mass = body_mass.at[TORSO_BODY_ID].set(
-        body_mass[TORSO_BODY_ID] + dmass
+    new_body_mass = new_body_mass.at[TORSO_BODY_ID].set(
+        new_body_mass[TORSO_BODY_ID] + dmass
     )
 
     # Jitter qpos0: +U(-0.05, 0.05).
     rng, key = jax.random.split(rng)
-    qpos0 = model.qpos0
-    qpos0 = qpos0.at[7:].set(
+    new_qpos0 = qpos0.at[7:].set(
         qpos0[7:]
         + jax.random.uniform(key, shape=(29,), minval=-0.05, maxval=0.05)
     )
 
     return (
-        pair_friction,
-        dof_frictionloss,
-        dof_armature,
-        body_mass,
-        qpos0,
+        new_pair_friction,
+        new_dof_frictionloss,
+        new_dof_armature,
+        new_body_mass,
+        new_qpos0,
     )
 
+  return sample(rng)
+
+
+def domain_randomize(model: mjx.Model, rng: jax.Array):
+  # Only fields that MJX reads directly are randomized, so no host-side
+  # mj_setConst pass is needed and sampling runs as one compiled call.
   (
       pair_friction,
       frictionloss,
       armature,
       body_mass,
       qpos0,
-  ) = rand_dynamics(rng)
+  ) = _rand_dynamics(
+      model.pair_friction,
+      model.dof_frictionloss,
+      model.dof_armature,
+      model.body_mass,
+      model.qpos0,
+      rng,
+  )
 
   in_axes = jax.tree_util.tree_map(lambda x: None, model)
   in_axes = in_axes.tree_replace({
@@ -23,6 +23,7 @@ import warnings
 from etils import epath
 from flax import struct
 import jax
+from jax import numpy as jp
 from ml_collections import config_dict
 import mujoco
 from mujoco import mjx
@@ -143,6 +144,9 @@ def make_data(
   data = mjx.make_data(
       model, impl=impl, nconmax=nconmax, njmax=njmax, device=device
   )
+  # `time` is created weakly typed; pin its dtype so that the first `step`
+  # does not change the carry type and force a second compilation.
+  data = data.replace(time=jp.asarray(data.time, dtype=jp.float32))
   if qpos is not None:
     data = data.replace(qpos=qpos)
   if qvel is not None:
@@ -1,17 +1,13 @@
 """Registry for all environments."""
-from typing import Any, Callable, Dict, Optional, Tuple, Union
+from typing import Any, Dict, Optional, Union
 
-import jax
 import ml_collections
-from mujoco import mjx
 
 from methods.envs import locomotion
 from methods.envs import manipulation
 from methods.envs import mjx_env
 
-DomainRandomizer = Optional[
-    Callable[[mjx.Model, jax.Array], Tuple[mjx.Model, mjx.Model]]
-]
+DomainRandomizer = locomotion.DomainRandomizer
 
 # A tuple containing all available environment names across all suites.
 ALL_ENVS = (
@@ -19,9 +15,7 @@ ALL_ENVS = (
 )
 
 # A tuple containing all available agent names.
-ALL_AGENTS = (
-    "PPO" + "FQL"
-)
+ALL_AGENTS = ("ppo", "fql")
 
 def get_default_config(env_name: str):
   if env_name in locomotion.ALL_ENVS:
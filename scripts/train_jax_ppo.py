@@ -14,6 +14,8 @@
 # ==============================================================================
 """Train a PPO/... agent using JAX on the specified environment."""
 
+import concurrent.futures
+import copy
 import datetime
 import functools
 import json
@@ -32,7 +34,7 @@ import jax.numpy as jp
 import mediapy as media
 from ml_collections import config_dict
 import mujoco
-import methods
+import numpy as np
 from methods.envs import registry
 from methods.envs import wrapper
 from methods.configs import locomotion_params
@@ -47,6 +49,15 @@ os.environ["XLA_FLAGS"] = xla_flags
 os.environ["XLA_PYTHON_CLIENT_PREALLOCATE"] = "false"
 os.environ["MUJOCO_GL"] = "egl"
 
+# Persist compiled XLA executables across runs (e.g. seed sweeps).
+jax.config.update(
+    "jax_compilation_cache_dir",
+    os.environ.get(
+        "JAX_COMPILATION_CACHE_DIR",
+        os.path.expanduser("~/.cache/jax_compilation_cache"),
+    ),
+)
+
 # Ignore the info logs from brax
 logging.set_verbosity(logging.WARNING)
 
@@ -59,6 +70,12 @@ warnings.filterwarnings("ignore", category=DeprecationWarning, module="jax")
 # Suppress UserWarnings from absl (used by JAX and TensorFlow)
 warnings.filterwarnings("ignore", category=UserWarning, module="absl")
 
+# Scene options used when rendering rollout videos.
+_DEFAULT_SCENE_OPTION = mujoco.MjvOption()
+_DEFAULT_SCENE_OPTION.flags[mujoco.mjtVisFlag.mjVIS_TRANSPARENT] = False
+_DEFAULT_SCENE_OPTION.flags[mujoco.mjtVisFlag.mjVIS_PERTFORCE] = False
+_DEFAULT_SCENE_OPTION.flags[mujoco.mjtVisFlag.mjVIS_CONTACTFORCE] = False
+
 
 _ENV_NAME = flags.DEFINE_string(
     "env_name",
@@ -70,7 +87,13 @@ _AGENT = flags.DEFINE_string(
     "ppo",
     f"Name of the agent. One of {', '.join(registry.ALL_AGENTS)}",
 )
-_IMPL = flags.DEFINE_enum("impl", "jax", ["jax", "warp"], "MJX implementation")
+_IMPL = flags.DEFINE_enum(
+    "impl",
+    "jax",
+    ["jax", "warp"],
+    "MJX implementation. 'warp' runs physics with MuJoCo Warp, which is"
+    " faster for contact-rich envs on NVIDIA GPUs.",
+)
 _SUFFIX = flags.DEFINE_string("suffix", None, "Suffix for the experiment name")
 _PLAY_ONLY = flags.DEFINE_boolean(
     "play_only", False, "If true, only play with the model and do not train"
@@ -166,18 +189,80 @@ _TRAINING_METRICS_STEPS = flags.DEFINE_integer(
     " experiences slowdown.",
 )
 
+# (flag, rl_params attribute path[, value transform]) applied in order when
+# the flag is given on the command line.
+_FLAG_OVERRIDES = (
+    (_NUM_TIMESTEPS, "num_timesteps"),
+    (_PLAY_ONLY, "num_timesteps", lambda _: 0),
+    (_NUM_EVALS, "num_evals"),
+    (_REWARD_SCALING, "reward_scaling"),
+    (_EPISODE_LENGTH, "episode_length"),
+    (_NORMALIZE_OBSERVATIONS, "normalize_observations"),
+    (_ACTION_REPEAT, "action_repeat"),
+    (_UNROLL_LENGTH, "unroll_length"),
+    (_NUM_MINIBATCHES, "num_minibatches"),
+    (_NUM_UPDATES_PER_BATCH, "num_updates_per_batch"),
+    (_DISCOUNTING, "discounting"),
+    (_LEARNING_RATE, "learning_rate"),
+    (_ENTROPY_COST, "entropy_cost"),
+    (_NUM_ENVS, "num_envs"),
+    (_NUM_EVAL_ENVS, "num_eval_envs"),
+    (_BATCH_SIZE, "batch_size"),
+    (_MAX_GRAD_NORM, "max_grad_norm"),
+    (_CLIPPING_EPSILON, "clipping_epsilon"),
+    (
+        _POLICY_HIDDEN_LAYER_SIZES,
+        "network_factory.policy_hidden_layer_sizes",
+        lambda v: list(map(int, v)),
+    ),
+    (
+        _VALUE_HIDDEN_LAYER_SIZES,
+        "network_factory.value_hidden_layer_sizes",
+        lambda v: list(map(int, v)),
+    ),
+    (_POLICY_OBS_KEY, "network_factory.policy_obs_key"),
+    (_VALUE_OBS_KEY, "network_factory.value_obs_key"),
+    (_RUN_EVALS, "run_evals"),
+    (_LOG_TRAINING_METRICS, "log_training_metrics"),
+    (_TRAINING_METRICS_STEPS, "training_metrics_steps"),
+)
+
+
+def _set_nested(cfg: config_dict.ConfigDict, attr_path: str, value) -> None:
+  *parents, name = attr_path.split(".")
+  for parent in parents:
+    cfg = getattr(cfg, parent)
+  setattr(cfg, name, value)
+
+
+_AGENT_DISPATCH = {
+    "ppo": locomotion_params.brax_ppo_config,
+    "fql": locomotion_params.brax_fql_config,
+}
+
 
 def get_rl_config(env_name: str, agent_name: str) -> config_dict.ConfigDict:
-  if env_name in methods.locomotion._envs:
-    if agent_name.lower() == "ppo":
-      return locomotion_params.brax_ppo_config(env_name, _IMPL.value)
-    elif agent_name.lower() == "fql":
-      return locomotion_params.brax_fql_config(env_name, _IMPL.value)
-    
-    return ValueError("Invalid agent name.")
+  if env_name in registry.ALL_ENVS:
+    agent_name = agent_name.lower()
+    if agent_name not in _AGENT_DISPATCH:
+      raise ValueError(
+          f"Agent {agent_name} not found in {registry.ALL_AGENTS}."
+      )
+    return _AGENT_DISPATCH[agent_name](env_name, _IMPL.value)
 
   raise ValueError(f"Env {env_name} not found in {registry.ALL_ENVS}.")
 
+@jax.jit
+def _episode_reward_stats(rew, done):
+  """Mean and std of per-episode rewards summed up to the first done flag."""
+  already_done = jax.lax.cummax(done, axis=0) > 0
+  valid_rewards = jax.lax.select(already_done, jp.zeros_like(rew), rew)
+  episode_rewards = jp.sum(valid_rewards, axis=0)
+  mean = jp.mean(episode_rewards)
+  std = jp.sqrt(jp.mean(jp.square(episode_rewards - mean)))
+  return mean, std
+
+
 def rscope_fn(full_states, obs, rew, done):
   """
   All arrays are of shape (unroll_length, rscope_envs, ...)
@@ -187,12 +272,10 @@ def rscope_fn(full_states, obs, rew, done):
   done: nd.array done flags
   """
   # Calculate cumulative rewards per episode, stopping at first done flag
-  done_mask = jp.cumsum(done, axis=0)
-  valid_rewards = rew * (done_mask == 0)
-  episode_rewards = jp.sum(valid_rewards, axis=0)
+  mean, std = _episode_reward_stats(rew, done)
   print(
       "Collected rscope rollouts with reward"
-      f" {episode_rewards.mean():.3f} +- {episode_rewards.std():.3f}"
+      f" {mean:.3f} +- {std:.3f}"
   )
 
 def main(argv):
@@ -206,63 +289,18 @@ def main(argv):
 
   rl_params = get_rl_config(_ENV_NAME.value, _AGENT.value)
 
-  if _NUM_TIMESTEPS.present:
-    rl_params.num_timesteps = _NUM_TIMESTEPS.value
-  if _PLAY_ONLY.present:
-    rl_params.num_timesteps = 0
-  if _NUM_EVALS.present:
-    rl_params.num_evals = _NUM_EVALS.value
-  if _REWARD_SCALING.present:
-    rl_params.reward_scaling = _REWARD_SCALING.value
-  if _EPISODE_LENGTH.present:
-    rl_params.episode_length = _EPISODE_LENGTH.value
-  if _NORMALIZE_OBSERVATIONS.present:
-    rl_params.normalize_observations = _NORMALIZE_OBSERVATIONS.value
-  if _ACTION_REPEAT.present:
-    rl_params.action_repeat = _ACTION_REPEAT.value
-  if _UNROLL_LENGTH.present:
-    rl_params.unroll_length = _UNROLL_LENGTH.value
-  if _NUM_MINIBATCHES.present:
-    rl_params.num_minibatches = _NUM_MINIBATCHES.value
-  if _NUM_UPDATES_PER_BATCH.present:
-    rl_params.num_updates_per_batch = _NUM_UPDATES_PER_BATCH.value
-  if _DISCOUNTING.present:
-    rl_params.discounting = _DISCOUNTING.value
-  if _LEARNING_RATE.present:
-    rl_params.learning_rate = _LEARNING_RATE.value
-  if _ENTROPY_COST.present:
-    rl_params.entropy_cost = _ENTROPY_COST.value
-  if _NUM_ENVS.present:
-    rl_params.num_envs = _NUM_ENVS.value
-  if _NUM_EVAL_ENVS.present:
-    rl_params.num_eval_envs = _NUM_EVAL_ENVS.value
-  if _BATCH_SIZE.present:
-    rl_params.batch_size = _BATCH_SIZE.value
-  if _MAX_GRAD_NORM.present:
-    rl_params.max_grad_norm = _MAX_GRAD_NORM.value
-  if _CLIPPING_EPSILON.present:
-    rl_params.clipping_epsilon = _CLIPPING_EPSILON.value
-  if _POLICY_HIDDEN_LAYER_SIZES.present:
-    rl_params.network_factory.policy_hidden_layer_sizes = list(
-        map(int, _POLICY_HIDDEN_LAYER_SIZES.value)
-    )
-  if _VALUE_HIDDEN_LAYER_SIZES.present:
-    rl_params.network_factory.value_hidden_layer_sizes = list(
-        map(int, _VALUE_HIDDEN_LAYER_SIZES.value)
-    )
-  if _POLICY_OBS_KEY.present:
-    rl_params.network_factory.policy_obs_key = _POLICY_OBS_KEY.value
-  if _VALUE_OBS_KEY.present:
-    rl_params.network_factory.value_obs_key = _VALUE_OBS_KEY.value
-  if _RUN_EVALS.present:
-    rl_params.run_evals = _RUN_EVALS.value
-  if _LOG_TRAINING_METRICS.present:
-    rl_params.log_training_metrics = _LOG_TRAINING_METRICS.value
-  if _TRAINING_METRICS_STEPS.present:
-    rl_params.training_metrics_steps = _TRAINING_METRICS_STEPS.value
+  for flag, attr_path, *transform in _FLAG_OVERRIDES:
+    if flag.present:
+      value = transform[0](flag.value) if transform else flag.value
+      _set_nested(rl_params, attr_path, value)
 
   env = registry.load(_ENV_NAME.value, config=env_cfg)
 
+  # Independent key streams for the rscope rollouts and the final videos.
+  master_key = jax.random.PRNGKey(_SEED.value)
+  rscope_key, rollout_key = jax.random.split(master_key)
+  video_keys = jax.random.split(rollout_key, _NUM_VIDEOS.value)
+
   print(f"Environment Config ({_ENV_NAME.value}):\n{env_cfg}")
   print(f"{_AGENT.value} Training Parameters:\n{rl_params}")
 
@@ -377,11 +415,9 @@ def main(argv):
             f" reward={metrics['episode/sum_reward']:.3f}"
         )
 
-  # Load evaluation environment.
-  eval_env = None
-  if True:
-    eval_env = registry.load(_ENV_NAME.value, config=env_cfg)
-  num_envs = 1
+  # Evaluation uses the same config as training, so it runs on the training
+  # env itself; brax builds separate wrappers around it for each role.
+  eval_env = env
 
   policy_params_fn = lambda *args: None
   if _RSCOPE_ENVS.value:
@@ -402,7 +438,7 @@ def main(argv):
         False,
         _RSCOPE_ENVS.value,
         _DETERMINISTIC_RSCOPE.value,
-        jax.random.PRNGKey(_SEED.value),
+        rscope_key,
         rscope_fn,
     )
 
@@ -410,80 +446,124 @@ def main(argv):
       rscope_handle.set_make_policy(make_policy)
       rscope_handle.dump_rollout(params)
 
-  # Train or load the model
-  make_inference_fn, params, _ = train_fn(  # pylint: disable=no-value-for-parameter
-      environment=env,
-      progress_fn=progress,
-      policy_params_fn=policy_params_fn,
-      eval_env=eval_env,
-  )
+  # Compile the post-training reset ahead of time on a background thread so
+  # that it overlaps with training. `eval_env` is the training env, whose
+  # mjx.Model the domain randomization wrapper temporarily swaps while
+  # tracing, so the worker traces a copy taken before training starts.
+  reset_env = copy.copy(eval_env)
+  video_rng_shape = jax.ShapeDtypeStruct(video_keys.shape, video_keys.dtype)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1) as compile_pool:
+    reset_compiled = compile_pool.submit(
+        lambda: jax.jit(jax.vmap(reset_env.reset))
+        .lower(video_rng_shape)
+        .compile()
+    )
+
+    # Train or load the model
+    make_inference_fn, params, _ = train_fn(  # pylint: disable=no-value-for-parameter
+        environment=env,
+        progress_fn=progress,
+        policy_params_fn=policy_params_fn,
+        eval_env=eval_env,
+    )
+    # Wait for outstanding device work so the timings measure compute, not
+    # dispatch.
+    params = jax.block_until_ready(params)
+    train_end = time.monotonic()
+    reset_fn = reset_compiled.result()
 
   print("Done training.")
   if len(times) > 1:
     print(f"Time to JIT compile: {times[1] - times[0]}")
-    print(f"Time to train: {times[-1] - times[1]}")
+    print(f"Time to train: {train_end - times[1]}")
 
   print("Starting inference...")
 
-  # Create inference function.
-  inference_fn = make_inference_fn(params, deterministic=True)
-  jit_inference_fn = jax.jit(inference_fn)
+  # Run evaluation rollouts. Only the data fields needed for rendering are
+  # archived, stacked by the scan as one array per field.
+  traj_fields = (
+      "qpos",
+      "qvel",
+      "time",
+      "ctrl",
+      "mocap_pos",
+      "mocap_quat",
+      "xfrc_applied",
+  )
 
-  # Run evaluation rollouts.
-  def do_rollout(rng, state):
-    empty_data = state.data.__class__(
-        **{k: None for k in state.data.__annotations__}
-    )  # pytype: disable=attribute-error
-    empty_traj = state.__class__(**{k: None for k in state.__annotations__})  # pytype: disable=attribute-error
-    empty_traj = empty_traj.replace(data=empty_data)
+  def do_rollout(params, rng, state):
+    # Params are an argument rather than a closure so they are passed to the
+    # executable as buffers instead of being embedded as constants.
+    inference_fn = make_inference_fn(params, deterministic=True)
 
     def step(carry, _):
       state, rng = carry
       rng, act_key = jax.random.split(rng)
-      act = jit_inference_fn(state.obs, act_key)[0]
+      act = inference_fn(state.obs, act_key)[0]
       state = eval_env.step(state, act)
-      traj_data = empty_traj.tree_replace({
-          "data.qpos": state.data.qpos,
-          "data.qvel": state.data.qvel,
-          "data.time": state.data.time,
-          "data.ctrl": state.data.ctrl,
-          "data.mocap_pos": state.data.mocap_pos,
-          "data.mocap_quat": state.data.mocap_quat,
-          "data.xfrc_applied": state.data.xfrc_applied,
-      })
+      # Archive in half precision; only the rendered copy is downcast while
+      # the simulated state stays float32.
+      traj_data = tuple(
+          getattr(state.data, k).astype(
+              jp.float32 if k == "time" else jp.float16
+          )
+          for k in traj_fields
+      )
       return (state, rng), traj_data
 
+    # A modest unroll amortizes per-iteration loop overhead for the small
+    # policy + physics step at the cost of a larger executable.
     _, traj = jax.lax.scan(
-        step, (state, rng), None, length=_EPISODE_LENGTH.value
+        step, (state, rng), None, length=_EPISODE_LENGTH.value, unroll=4
     )
     return traj
 
-  rng = jax.random.split(jax.random.PRNGKey(_SEED.value), _NUM_VIDEOS.value)
-  reset_states = jax.jit(jax.vmap(eval_env.reset))(rng)
-  traj_stacked = jax.jit(jax.vmap(do_rollout))(rng, reset_states)
-  trajectories = [None] * _NUM_VIDEOS.value
-  for i in range(_NUM_VIDEOS.value):
-    t = jax.tree.map(lambda x, i=i: x[i], traj_stacked)
-    trajectories[i] = [
-        jax.tree.map(lambda x, j=j: x[j], t)
-        for j in range(_EPISODE_LENGTH.value)
-    ]
+  reset_states = reset_fn(video_keys)
+  # Structure-only template used to rebuild per-step states for rendering.
+  empty_traj = jax.tree.map(lambda _: None, reset_states)
+  # The policy and env step are traced into a single rollout executable.
+  rollout_jit = jax.jit(jax.vmap(do_rollout, in_axes=(None, 0, 0)))
+  traj_stacked = rollout_jit(jax.device_put(params), video_keys, reset_states)
+  del reset_states
+  # Transfer once and slice on the host instead of dispatching per-step slices.
+  traj_host = jax.tree.map(
+      lambda x: np.asarray(x, dtype=np.float32), jax.device_get(traj_stacked)
+  )
+  trajectories = [
+      [
+          empty_traj.tree_replace({
+              f"data.{k}": x[i, j] for k, x in zip(traj_fields, traj_host)
+          })
+          for j in range(_EPISODE_LENGTH.value)
+      ]
+      for i in range(_NUM_VIDEOS.value)
+  ]
 
   # Render and save the rollout.
   render_every = 2
   fps = 1.0 / eval_env.dt / render_every
   print(f"FPS for rendering: {fps}")
-  scene_option = mujoco.MjvOption()
-  scene_option.flags[mujoco.mjtVisFlag.mjVIS_TRANSPARENT] = False
-  scene_option.flags[mujoco.mjtVisFlag.mjVIS_PERTFORCE] = False
-  scene_option.flags[mujoco.mjtVisFlag.mjVIS_CONTACTFORCE] = False
-  for i, rollout in enumerate(trajectories):
-    traj = rollout[::render_every]
-    frames = eval_env.render(
-        traj, height=480, width=640, scene_option=scene_option
-    )
-    media.write_video(f"rollout{i}.mp4", frames, fps=fps)
-    print(f"Rollout video saved as 'rollout{i}.mp4'.")
+  # Render all rollouts with a single renderer and split the frames per video.
+  trajs = [rollout[::render_every] for rollout in trajectories]
+  all_frames = np.stack(
+      eval_env.render(
+          [state for traj in trajs for state in traj],
+          height=480,
+          width=640,
+          scene_option=_DEFAULT_SCENE_OPTION,
+      )
+  )
+  splits = np.cumsum([len(traj) for traj in trajs])[:-1]
+  # Encode the videos concurrently from views of the stacked frames; ffmpeg
+  # runs outside the GIL.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+    writes = [
+        pool.submit(media.write_video, f"rollout{i}.mp4", frames, fps=fps)
+        for i, frames in enumerate(np.split(all_frames, splits))
+    ]
+    for i, write in enumerate(writes):
+      write.result()
+      print(f"Rollout video saved as 'rollout{i}.mp4'.")
 
 
 if __name__ == "__main__":